@@ -0,0 +1,155 @@
+'''
+A binary format of event files, which is read through a memory map instead of being parsed line by line.
+The file starts with a magic number and the offset of its header, followed by fixed-width records (one per event),
+and ends with the header. A record holds the timestamp of the event followed by its fields, 8 bytes each:
+ints are stored as int64, floats as doubles and strings as indexes to the string table of the header.
+The header is stored in JSON, and holds the names and the types of the columns, the event type key,
+the number of records and the string table.
+'''
+
+from __future__ import annotations
+from typing import List
+from Event import Event, EventSchema, SchemaEvent, timestampToDate
+from EventBatch import EventBatch
+from IODataStructures import Stream
+from itertools import islice
+import json
+import mmap
+import struct
+
+MAGIC = b"CEPEVT01"
+PREFIX = struct.Struct("<8sQ")
+COLUMN_TYPES = {int: "int", float: "float", str: "str"}
+COLUMN_FORMATS = {"int": "q", "float": "d", "str": "q"}
+# The number of events which are added to a stream at once.
+READ_CHUNK_SIZE = 1000
+
+'''
+Writes events to a binary event file. The type of every column is int, float or str.
+'''
+class BinaryEventFileWriter:
+    def __init__(self, filePath: str, keyMap: List, columnTypes: List, eventTypeKey: str):
+        for columnType in columnTypes:
+            if columnType not in COLUMN_TYPES:
+                raise TypeError("Binary event files support int, float and str columns, not %s" % columnType)
+        self.keyMap = list(keyMap)
+        self.columnTypes = [COLUMN_TYPES[columnType] for columnType in columnTypes]
+        self.eventTypeKey = eventTypeKey
+        self.stringColumns = [i for i, columnType in enumerate(columnTypes) if columnType is str]
+        self.record = struct.Struct("<q" + "".join(COLUMN_FORMATS[columnType] for columnType in self.columnTypes))
+        self.strings = {}
+        self.count = 0
+        self.file = open(filePath, "wb")
+        self.file.write(PREFIX.pack(MAGIC, 0))
+
+    # Writes an event, given the values of its columns and its timestamp.
+    def write(self, values: List, timestamp: int):
+        values = list(values)
+        for i in self.stringColumns:
+            values[i] = self.strings.setdefault(values[i], len(self.strings))
+        self.file.write(self.record.pack(timestamp, *values))
+        self.count += 1
+
+    # Writes the header and closes the file.
+    def close(self):
+        headerOffset = self.file.tell()
+        header = {"keys": self.keyMap, "types": self.columnTypes, "eventTypeKey": self.eventTypeKey,
+                  "count": self.count, "strings": list(self.strings)}
+        self.file.write(json.dumps(header).encode())
+        self.file.seek(0)
+        self.file.write(PREFIX.pack(MAGIC, headerOffset))
+        self.file.close()
+
+'''
+A binary event file, mapped to memory. Its events are unpacked from the mapped records, and its batches are
+EventBatch objects whose numeric columns and timestamps are views of the mapped records, rather than copies.
+The file is closed by close (or at the end of a with statement). The batches which were read remain valid after that,
+so the memory map is only unmapped once they are released.
+'''
+class BinaryEventFile:
+    def __init__(self, filePath: str):
+        with open(filePath, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, headerOffset = PREFIX.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a binary event file" % filePath)
+        header = json.loads(self.map[headerOffset:].decode())
+        self.keyMap = header["keys"]
+        self.columnTypes = header["types"]
+        self.typeIndex = self.keyMap.index(header["eventTypeKey"])
+        self.count = header["count"]
+        self.strings = header["strings"]
+        self.stringColumns = [i for i, columnType in enumerate(self.columnTypes) if columnType == "str"]
+        self.record = struct.Struct("<q" + "".join(COLUMN_FORMATS[columnType] for columnType in self.columnTypes))
+        self.records = memoryview(self.map)[PREFIX.size:PREFIX.size + self.count * self.record.size]
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Releases the view of the records and closes the memory map. If views of the map are still held by batches,
+    # it can not be closed yet, and it is unmapped when the last of them is released.
+    def close(self):
+        self.records.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+    # Returns the events of the file, one by one. Compact events are schema events.
+    def events(self, compact: bool = False):
+        schema = EventSchema(self.keyMap)
+        strings, stringColumns, typeIndex = self.strings, self.stringColumns, self.typeIndex
+        lastTimestamp, lastDate = None, None
+        for record in self.record.iter_unpack(self.records):
+            values = list(record[1:])
+            for i in stringColumns:
+                values[i] = strings[values[i]]
+            timestamp = record[0]
+            if compact:
+                yield SchemaEvent(schema, tuple(values), values[typeIndex], timestamp)
+                continue
+            if timestamp != lastTimestamp:
+                lastTimestamp, lastDate = timestamp, timestampToDate(timestamp)
+            yield Event(dict(zip(self.keyMap, values)), values[typeIndex], lastDate, timestamp)
+
+    # Returns the events of the file in batches of the given size.
+    def batches(self, batchSize: int):
+        fieldsNum = len(self.keyMap) + 1
+        integers = self.records.cast("q")
+        floats = self.records.cast("d")
+        for start in range(0, self.count, batchSize):
+            end = min(start + batchSize, self.count)
+            columns = {}
+            for i, (key, columnType) in enumerate(zip(self.keyMap, self.columnTypes)):
+                values = (floats if columnType == "float" else integers)[start * fieldsNum + i + 1:end * fieldsNum:fieldsNum]
+                if columnType == "str":
+                    values = [self.strings[index] for index in values]
+                columns[key] = values
+            timestamps = integers[start * fieldsNum:end * fieldsNum:fieldsNum]
+            yield EventBatch.fromColumns(columns, columns[self.keyMap[self.typeIndex]], timestamps)
+
+    # Reads the events of the file into the given stream, and closes it (with the error, if the file can not be read).
+    # The file is closed as well, since all its events are in the stream.
+    def readEvents(self, batchSize: int, compact: bool, events: Stream):
+        try:
+            if batchSize:
+                for batch in self.batches(batchSize):
+                    events.addItem(batch)
+            else:
+                eventsIterator = self.events(compact)
+                chunk = list(islice(eventsIterator, READ_CHUNK_SIZE))
+                while chunk:
+                    events.addItems(chunk)
+                    chunk = list(islice(eventsIterator, READ_CHUNK_SIZE))
+        except Exception as error:
+            events.setError(error)
+            raise
+        finally:
+            events.close()
+            self.close()
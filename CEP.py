@@ -1,18 +1,28 @@
 '''
 This file contains the primary engine,
 which invokes evaluations and manages streams.
-It now is supporting multiple patterns in a very non-sophisticated way:
-It just invokes the same algorithm multiple times in parallel. But in future versions,
-there is an option to add a multiple patterns support in the algorithms. 
+It supports multiple patterns in a non-sophisticated way by default:
+It just invokes the same algorithm multiple times in parallel.
+If the algorithm is multiple pattern compatible, all the patterns are sent to a single evaluation instead.
+Alternatively, all patterns can share a single event feed: one thread reads every event once
+and dispatches it to the evaluations of all the patterns.
+The patterns can also be evaluated by worker processes instead of threads (see ParallelEvaluation),
+and every pattern can be evaluated in several partitions of the events.
 '''
 
 import threading
+import os
+from threading import Lock
 from Event import Event
 from PatternMatch import PatternMatch
 from IODataStructures import Stream, Container
 from Pattern import Pattern
 from typing import List
 from EvaluationMechanism import EvaluationMechanism
+from Utils import ExecutionBackendType
+from ParallelEvaluation import ProcessEvaluationWorker, PartitionedEvaluation
+from Statistics import StatisticsCollector
+from datetime import timedelta
 
 # A sketch of QoS specifications, we assume it will be an object constructed separately, and the
 # CEP engine will refer to it if it is passed.
@@ -25,43 +35,271 @@ class CEP:
     '''
     This class has an algorithm, an input stream and an output container.
     It also has several input patterns which can always be added after init, and some configuration parameters.
+    If sharedEventFeed is set, the events are not copied to a stream per pattern. Instead, a single thread
+    consumes the event stream and sends every event to the evaluations of all the patterns. It can not be combined
+    with a multiple pattern algorithm, with partitions or with worker processes.
+    The execution backend decides whether the patterns are evaluated by threads or by worker processes.
+    With worker processes, the patterns are split between at most processesNum workers (default: CPU count).
+    If partitionsNum is greater than 1, every pattern is evaluated in partitionsNum partitions of the events,
+    according to partitionKey (a function from an event to a value), or to a key inferred from the pattern.
+    If statisticsWindow is given, the statistics of every pattern are collected by its evaluation over a sliding
+    window of this duration (see StatisticsCollector), and can be read at any time by getStatistics.
+    Statistics are collected only by patterns which are evaluated by threads, each with its own evaluation.
+    If reoptimizationPeriod is given, the evaluation tree of every pattern is re-optimized once every period (in event
+    time) on the collected statistics, and replaced if the cost of the new tree is lower by at least
+    reoptimizationThreshold (a fraction of the current cost). The statistics are then collected over a window of
+    statisticsWindow, or of reoptimizationPeriod if it is not given.
     '''
+    forwardBatchSize = 1000
+
     def __init__(self, algorithm: EvaluationMechanism, patterns: List[Pattern] = None, events: Stream = None, 
-        output: Container = None, saveReplica: bool = True, 
-        performanceSpecs : PerformanceSpecifications = None):
-        if algorithm.isMultiplePatternCompatible():
-            raise NotImplementedError()
-        # Otherwise, every pattern is handled separately.
+        output: Container = None, saveReplica: bool = None, 
+        performanceSpecs : PerformanceSpecifications = None, sharedEventFeed: bool = False,
+        executionBackend: ExecutionBackendType = ExecutionBackendType.THREADS, processesNum: int = None,
+        partitionsNum: int = 1, partitionKey = None, statisticsWindow: timedelta = None,
+        reoptimizationPeriod: timedelta = None, reoptimizationThreshold: float = 0.1):
         self.eventStreams = []
         self.patternMatches = output if output else Stream()
         self.algorithmObjects = {}
         self.algorithm = algorithm
+        # A live event stream is still being filled (e.g. by a file reader), so it can not be copied. Instead, its events
+        # are forwarded to the evaluations as they arrive (through the replica if it is saved, or otherwise through
+        # event streams of the same bound). A bounded stream is forwarded as well, since it has a single cursor
+        # (see Stream.duplicate).
+        # By default, the replica of a live stream is not saved, since it would keep all the events in memory.
+        liveEvents = events if events is not None and (events.isLive or events.maxSize > 0) else None
+        self.eventStreamsMaxSize = liveEvents.maxSize if liveEvents else 0
+        if saveReplica is None:
+            saveReplica = not liveEvents
+        # The error which stopped the events from being evaluated: the error of the live event stream's producer,
+        # or of the shared event feed.
+        self.inputError = None
         # base stream is the replica being saved
-        if saveReplica and events:
+        if saveReplica and events and not liveEvents:
             self.baseStream = events
         elif saveReplica:
             self.baseStream = Stream()
         else:
             self.baseStream = None
         
+        self.sharedEventFeed = sharedEventFeed
+        self.executionBackend = executionBackend
+        self.partitionsNum = partitionsNum
+        self.partitionKey = partitionKey
+        self.isMultiplePatternEvaluation = algorithm.isMultiplePatternCompatible()
+        self.statisticsWindow = statisticsWindow if statisticsWindow or not reoptimizationPeriod else reoptimizationPeriod
+        self.reoptimizationPeriod = reoptimizationPeriod
+        self.reoptimizationThreshold = reoptimizationThreshold
+        self.statisticsCollectors = {}
+        # These options apply only to patterns which are evaluated by threads, each with its own evaluation.
+        threadOptions = []
+        if self.statisticsWindow:
+            threadOptions.append("statisticsWindow" if statisticsWindow else "reoptimizationPeriod")
+        if sharedEventFeed:
+            threadOptions.append("sharedEventFeed")
+        for option in threadOptions:
+            if self.isMultiplePatternEvaluation:
+                raise ValueError("%s can not be used with a multiple pattern algorithm" % option)
+            if partitionsNum > 1:
+                raise ValueError("%s can not be used with partitionsNum > 1" % option)
+            if executionBackend == ExecutionBackendType.PROCESSES:
+                raise ValueError("%s can not be used with the PROCESSES execution backend" % option)
+        self.initEvaluations(patterns, processesNum)
+        if liveEvents:
+            threading.Thread(target = self.forwardEvents, args = (liveEvents,), daemon = True).start()
+
+    def initEvaluations(self, patterns: List[Pattern], processesNum: int):
+        # Every evaluation closes the output container once (a multiple pattern evaluation closes it once for all the
+        # patterns), so all of them are registered before any of them starts.
+        if patterns:
+            for _ in range(1 if self.isMultiplePatternEvaluation else len(patterns)):
+                self.patternMatches.addProducer()
+
+        if self.isMultiplePatternEvaluation:
+            self.initMultiplePatternEvaluation(patterns)
+            return
+
+        if self.partitionsNum > 1:
+            if patterns:
+                # all the worker processes are forked before any of their threads start.
+                evaluations = [self.createPartitionedEvaluation(pattern) for pattern in patterns]
+                for evaluation in evaluations:
+                    evaluation.start()
+            return
+
+        if self.executionBackend == ExecutionBackendType.PROCESSES:
+            self.initProcessEvaluation(patterns, processesNum if processesNum else os.cpu_count())
+            return
+
+        if self.sharedEventFeed:
+            self.initSharedEventFeed(patterns)
+            return
+
+        # Otherwise, every pattern is handled separately.
         # Initialize all given pattern evaluation.
         # For each pattern we send to the algorithm evaluation function the pattern, the input stream, the output stream,
         # and measureTime=True, in order to measure the time it took to evaluate it. We start the evaluation in
         # a new thread.
         if patterns:
             for pattern in patterns:
-                eventStream = self.baseStream.duplicate() if self.baseStream else Stream()
-                self.algorithmObjects[pattern] = algorithm.copy()
+                eventStream = self.createEventStream()
+                self.createEvaluation(pattern)
                 worker = threading.Thread(target = self.algorithmObjects[pattern].eval, args = (pattern, eventStream, self.patternMatches, True))
                 worker.start()
-                self.eventStreams.append(eventStream)
+
+    # Creates the evaluation of a single pattern, which collects the pattern's statistics if statisticsWindow is given,
+    # and re-optimizes its tree if reoptimizationPeriod is given.
+    def createEvaluation(self, pattern: Pattern):
+        evaluation = self.algorithm.copy()
+        if self.statisticsWindow:
+            evaluation.statisticsCollector = StatisticsCollector(pattern, self.statisticsWindow)
+            self.statisticsCollectors[pattern] = evaluation.statisticsCollector
+        if self.reoptimizationPeriod:
+            evaluation.reoptimizationPeriod = self.reoptimizationPeriod
+            evaluation.reoptimizationThreshold = self.reoptimizationThreshold
+        self.algorithmObjects[pattern] = evaluation
+        return evaluation
+
+    # Creates the event stream of a new evaluation. If the replica of the events is saved, the new stream is a
+    # duplicate of it, which shares its log, so the events which are added to the replica are read by it as well.
+    # Otherwise, it is a separate stream, to which the new events are added.
+    def createEventStream(self):
+        if self.baseStream:
+            return self.baseStream.duplicate()
+        eventStream = Stream(self.eventStreamsMaxSize)
+        self.eventStreams.append(eventStream)
+        return eventStream
+
+    # Forwards the events of a live stream to the evaluations, and closes them when the live stream is over.
+    # If the producer of the live stream failed, the events which were read are still evaluated, and the error is
+    # passed on to the output container and raised by getElapsed.
+    def forwardEvents(self, events: Stream):
+        try:
+            batch = events.getItems(self.forwardBatchSize)
+            while batch:
+                self.addEvents(batch)
+                batch = events.getItems(self.forwardBatchSize)
+        except Exception as error:
+            self.inputError = error
+            self.patternMatches.setError(error)
+        finally:
+            self.close()
 
     # This is a blocking function which will wait for the evaluation to finish and then return the
     # time it took to evalute the given pattern.
     def getElapsed(self, pattern):
         if pattern not in self.algorithmObjects.keys():
             raise Exception("Pattern is not evaluated")
-        return self.algorithmObjects[pattern].getElapsed()
+        elapsed = self.algorithmObjects[pattern].getElapsed()
+        if self.inputError is not None:
+            raise self.inputError
+        return elapsed
+
+    # Returns the statistics of the given pattern in the current sliding window, in the shape of
+    # StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES.
+    def getStatistics(self, pattern):
+        if pattern not in self.statisticsCollectors.keys():
+            raise Exception("Pattern statistics are not collected")
+        return self.statisticsCollectors[pattern].getStatistics()
+
+    # Initialize a single evaluation of all the patterns, by a multiple pattern compatible algorithm.
+    # The evaluation (and its elapsed time) is shared by all the patterns.
+    def initMultiplePatternEvaluation(self, patterns: List[Pattern]):
+        if not patterns:
+            raise ValueError("The patterns of a multiple pattern algorithm must be given when the CEP object is constructed")
+        eventStream = self.createEventStream()
+        evaluation = self.algorithm.copy()
+        for pattern in patterns:
+            self.algorithmObjects[pattern] = evaluation
+        worker = threading.Thread(target = evaluation.eval, args = (patterns, eventStream, self.patternMatches, True))
+        worker.start()
+
+    # Initialize the evaluation of the patterns by worker processes. The patterns are split evenly between
+    # the workers, and every worker gets its own copy of the event stream.
+    # All the workers are forked before any of their threads start, since forking while other threads run is unsafe.
+    def initProcessEvaluation(self, patterns: List[Pattern], processesNum: int):
+        if not patterns:
+            return
+        groupsNum = min(processesNum, len(patterns))
+        workers = [self.createProcessEvaluation(patterns[i::groupsNum]) for i in range(groupsNum)]
+        for worker in workers:
+            worker.start()
+
+    def createProcessEvaluation(self, patterns: List[Pattern]):
+        eventStream = self.createEventStream()
+        worker = ProcessEvaluationWorker(self.algorithm, patterns, eventStream, self.patternMatches)
+        for pattern in patterns:
+            self.algorithmObjects[pattern] = worker.getEvaluation(pattern)
+        return worker
+
+    def createPartitionedEvaluation(self, pattern: Pattern):
+        eventStream = self.createEventStream()
+        self.algorithmObjects[pattern] = PartitionedEvaluation(self.algorithm, pattern, eventStream, self.patternMatches,
+                                                               self.partitionsNum, self.partitionKey, self.executionBackend)
+        return self.algorithmObjects[pattern]
+
+    # Initialize the evaluation of all patterns from a single event feed.
+    # New evaluations are registered by the dispatching thread, before it dispatches the next event.
+    def initSharedEventFeed(self, patterns: List[Pattern]):
+        self.eventFeed = self.createEventStream()
+        self.evaluations = []
+        self.newEvaluations = []
+        self.newEvaluationsLock = Lock()
+        self.isFeedExhausted = False
+        self.dispatchedEventsCount = 0
+        if patterns:
+            for pattern in patterns:
+                self.startPatternEvaluation(pattern)
+        self.dispatcher = threading.Thread(target = self.dispatchEvents)
+        self.dispatcher.start()
+
+    # The shared event feed's thread. Every event is read once and is handled by all evaluations, in batches.
+    # The time measured for each pattern is the time from its registration until the feed is exhausted.
+    # If the feed or one of the evaluations fails, all the evaluations are still ended, so that the consumers of
+    # the matches do not wait for them, and the error is passed on to the output container and raised by getElapsed.
+    def dispatchEvents(self):
+        try:
+            batch = self.eventFeed.getItems(self.forwardBatchSize)
+            while batch:
+                if self.newEvaluations:
+                    self.registerNewEvaluations()
+                for evaluation in self.evaluations:
+                    evaluation.handleEvents(batch)
+                self.dispatchedEventsCount += len(batch)
+                batch = self.eventFeed.getItems(self.forwardBatchSize)
+        except Exception as error:
+            self.inputError = error
+            self.patternMatches.setError(error)
+        finally:
+            with self.newEvaluationsLock:
+                self.isFeedExhausted = True
+            try:
+                self.registerNewEvaluations()
+            finally:
+                self.endEvaluations(self.evaluations)
+
+    # Ends the given evaluations. Every evaluation is ended even if ending another one failed.
+    def endEvaluations(self, evaluations):
+        firstError = None
+        for evaluation in evaluations:
+            try:
+                evaluation.endEvaluation()
+            except Exception as error:
+                firstError = firstError or error
+        if firstError is not None:
+            raise firstError
+
+    # Start the evaluations which were added since the last dispatched event.
+    # If a replica is saved, the already dispatched events are replayed to the new evaluations.
+    def registerNewEvaluations(self):
+        with self.newEvaluationsLock:
+            newEvaluations = self.newEvaluations
+            self.newEvaluations = []
+        for pattern, evaluation in newEvaluations:
+            evaluation.startEvaluation(pattern, self.patternMatches, True)
+            self.evaluations.append(evaluation)
+            if self.baseStream:
+                evaluation.handleEvents(self.baseStream.peekItems(self.dispatchedEventsCount))
 
     # Add an event to the event stream. Useful for realtime events.
     # Since every pattern evaluation consumes events from a different stream,
@@ -71,6 +309,13 @@ class CEP:
             eventStream.addItem(event)
         if self.baseStream:
             self.baseStream.addItem(event)
+
+    # Add several events to be evaluated by this CEP object at once.
+    def addEvents(self, events: List[Event]):
+        for eventStream in self.eventStreams:
+            eventStream.addItems(events)
+        if self.baseStream:
+            self.baseStream.addItems(events)
     
     # Add a pattern to be evaluated by this CEP object.
     # we send to the algorithm evaluation function the pattern, the input stream, the output stream,
@@ -79,11 +324,36 @@ class CEP:
     def addPattern(self, pattern: Pattern, priority: int = 0):
         if pattern in self.algorithmObjects.keys():
             return # pattern is already evaluated.
-        eventStream = self.baseStream.duplicate() if self.baseStream else Stream()
-        self.algorithmObjects[pattern] = self.algorithm.copy()
+        if self.isMultiplePatternEvaluation:
+            # the patterns are merged into a single evaluation when the engine is constructed.
+            raise ValueError("Patterns can not be added to the evaluation of a multiple pattern algorithm")
+        self.patternMatches.addProducer()
+        self.startPatternEvaluation(pattern)
+
+    # Starts the evaluation of a single pattern, whose evaluation is already registered in the output container.
+    def startPatternEvaluation(self, pattern: Pattern):
+        if self.partitionsNum > 1:
+            self.createPartitionedEvaluation(pattern).start()
+            return
+        if self.executionBackend == ExecutionBackendType.PROCESSES:
+            self.createProcessEvaluation([pattern]).start()
+            return
+        if self.sharedEventFeed:
+            self.createEvaluation(pattern)
+            with self.newEvaluationsLock:
+                if not self.isFeedExhausted:
+                    self.newEvaluations.append((pattern, self.algorithmObjects[pattern]))
+                    return
+            # the feed is over, so the pattern can only be evaluated on the replica.
+            eventStream = self.createEventStream()
+            eventStream.close()
+            worker = threading.Thread(target = self.algorithmObjects[pattern].eval, args = (pattern, eventStream, self.patternMatches, True))
+            worker.start()
+            return
+        eventStream = self.createEventStream()
+        self.createEvaluation(pattern)
         worker = threading.Thread(target = self.algorithmObjects[pattern].eval, args = (pattern, eventStream, self.patternMatches))
         worker.start()
-        self.eventStreams.append(eventStream)
     
     # return one match from the output container.
     def getPatternMatch(self):
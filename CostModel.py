@@ -0,0 +1,124 @@
+'''
+The cost model of the tree construction algorithms, given a selectivity matrix, arrival rates and a window.
+The number of partial matches of a set of arguments (PM) is the product of the number of events of every argument in
+the window (window * arrivalRate(i) * sel(i,i)) and of the selectivities of all the pairs of arguments in the set.
+It does not depend on the topology in which the arguments are joined, so it is computed once for every set, from the
+set without its largest argument. The cost of a tree is the sum of the PMs of its nodes, and the cost of an order is the
+sum of the PMs of its prefixes (see calculateTreeCostFunction and calculateOrderCostFunction in Statistics.py).
+The (args, PM, cost) triple of every subtree is cached as well, so that trees which share subtrees are costed once.
+The model also keeps the prefixes of a current order, from which the cost difference of a move of iterative improvement
+(a swap or a circle) is computed in O(n): only the prefixes between the first and the last moved position change,
+and the selectivities of every argument with the new prefix are derived from the products of its selectivities with
+the current prefixes.
+'''
+
+from typing import List
+
+class CostModel:
+    def __init__(self, selectivityMatrix: List[List[float]], arrivalRates: List[float], windowInSecs: float):
+        self.selectivityMatrix = selectivityMatrix
+        self.leafSizes = [windowInSecs * arrivalRates[i] * selectivityMatrix[i][i] for i in range(len(arrivalRates))]
+        self.sizes = {}
+        self.subtrees = {}
+        self.order = None
+
+    # Returns the number of partial matches of the given set of arguments.
+    def getPartialMatchesSize(self, args: frozenset):
+        size = self.sizes.get(args)
+        if size is None:
+            if len(args) == 1:
+                size = self.leafSizes[next(iter(args))]
+            else:
+                last = max(args)
+                rest = args.difference({last})
+                size = self.getPartialMatchesSize(rest) * self.leafSizes[last]
+                row = self.selectivityMatrix[last]
+                for i in rest:
+                    size *= row[i]
+            self.sizes[args] = size
+        return size
+
+    # Returns the arguments, the number of partial matches and the cost of the given tree (an argument index or a pair
+    # of trees).
+    def getSubtree(self, tree):
+        subtree = self.subtrees.get(tree)
+        if subtree is None:
+            if type(tree) == int:
+                size = self.leafSizes[tree]
+                subtree = (frozenset({tree}), size, size)
+            else:
+                leftArgs, _, leftCost = self.getSubtree(tree[0])
+                rightArgs, _, rightCost = self.getSubtree(tree[1])
+                args = leftArgs.union(rightArgs)
+                size = self.getPartialMatchesSize(args)
+                subtree = (args, size, leftCost + rightCost + size)
+            self.subtrees[tree] = subtree
+        return subtree
+
+    def getTreeCost(self, tree):
+        return self.getSubtree(tree)[2]
+
+    def getOrderCost(self, order: List[int]):
+        cost = 0.0
+        args = frozenset()
+        for i in order:
+            args = args.union({i})
+            cost += self.getPartialMatchesSize(args)
+        return cost
+
+    # Sets the current order, whose moves are costed by getMoveCostDifference.
+    # prefixSelectivities[i][p] is the product of the selectivities of argument i with the first p arguments of the order,
+    # and prefixSizes[p] is the number of partial matches of the first p + 1 arguments.
+    def setOrder(self, order: List[int]):
+        self.order = list(order)
+        self.prefixSelectivities = []
+        for row in self.selectivityMatrix:
+            products = [1.0]
+            for i in self.order:
+                products.append(products[-1] * row[i])
+            self.prefixSelectivities.append(products)
+        self.prefixSizes = []
+        size = 1.0
+        for p, i in enumerate(self.order):
+            size *= self.leafSizes[i] * self.prefixSelectivities[i][p]
+            self.prefixSizes.append(size)
+
+    def getCurrentOrderCost(self):
+        return sum(self.prefixSizes)
+
+    # Returns the difference between the cost of the given order and the cost of the current order, where the given
+    # order is the current order after a move of the given positions (e.g. a swap or a circle).
+    def getMoveCostDifference(self, newOrder: List[int], positions):
+        first, last = min(positions), max(positions)
+        selectivityMatrix = self.selectivityMatrix
+        size = self.prefixSizes[first - 1] if first > 0 else 1.0
+        # The arguments which were added to the current prefix by the move, and the arguments which were removed from it.
+        added, removed = [], []
+        difference = 0.0
+        for p in range(first, last):
+            i = newOrder[p]
+            row = selectivityMatrix[i]
+            selectivity = self.prefixSelectivities[i][p]
+            for j in added:
+                selectivity *= row[j]
+            for j in removed:
+                if row[j] == 0:
+                    # The selectivity with the current prefix can not be divided by this selectivity.
+                    selectivity = 1.0
+                    for k in newOrder[:p]:
+                        selectivity *= row[k]
+                    break
+                selectivity /= row[j]
+            size *= self.leafSizes[i] * selectivity
+            difference += size - self.prefixSizes[p]
+            current = self.order[p]
+            if i != current:
+                if i in removed:
+                    removed.remove(i)
+                else:
+                    added.append(i)
+                if current in added:
+                    added.remove(current)
+                else:
+                    removed.append(current)
+        return difference
@@ -1,20 +1,39 @@
 from abc import ABC
 from Pattern import Pattern
 from IODataStructures import Stream, Container
+from Event import Event
+from typing import List
 
 '''
 Every evaluation mechanism shall inherit from the evaluation mechanism class and implement the
 eval function which is used for evaluation. The evaluation mechanism may extend eval's signature if
 the evaluation depends on more parameters, but shall include all presented parameters.
 Contravariance of paramקter types is allowed.
+An evaluation mechanism may also be driven event by event, instead of pulling the events from a stream:
+startEvaluation is called once, then handleEvent is called for every event, and endEvaluation is called
+when there are no more events. This is required in order to share a single event feed between patterns.
+Events may also be handled in batches (handleEvents), which lets a mechanism process several events at once.
 '''
 
 class EvaluationMechanism(ABC):
     def eval(self, pattern: Pattern, events: Stream, matches: Container):
         pass
 
+    def startEvaluation(self, pattern: Pattern, matches: Container):
+        pass
+
+    def handleEvent(self, event: Event):
+        pass
+
+    def handleEvents(self, events: List[Event]):
+        for event in events:
+            self.handleEvent(event)
+
+    def endEvaluation(self):
+        pass
+
     def isMultiplePatternCompatible(self):
         pass
 
     def copy(self):
-        pass
\ No newline at end of file
+        pass
@@ -4,14 +4,119 @@ The Event class has an event field which is a dictionary mapping between
 field names and fields.
 It also have an event type - the type which might be required in a pattern's structure,
 and the timestamp of the event, which is referred to as "date".
+Every event also has an integer timestamp (microseconds since the epoch), which is used by the
+evaluation mechanisms in order to compare the times of events efficiently.
+A schema event is a compact alternative: its fields are stored in a tuple, and the field names are
+stored once in a schema shared by all the events of the same structure.
 '''
 
 from __future__ import annotations
-from typing import Dict
-from datetime import datetime
+from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def dateToTimestamp(date: datetime):
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date - EPOCH) // MICROSECOND
+
+def timestampToDate(timestamp: int):
+    return EPOCH + timedelta(microseconds=timestamp)
 
 class Event:
-    def __init__(self, event: Dict, eventType, date: datetime):
+    __slots__ = ("event", "eventType", "date", "timestamp")
+
+    def __init__(self, event: Dict, eventType, date: datetime, timestamp: int = None):
         self.event = event
         self.eventType = eventType
-        self.date = date
\ No newline at end of file
+        self.date = date
+        if timestamp is None and date is not None:
+            timestamp = dateToTimestamp(date)
+        self.timestamp = timestamp
+
+'''
+A base class for compact events, which are also the mapping of their own fields (event.event is the event itself),
+so that event.event[key] keeps working without a dictionary per event.
+Subclasses implement getValue and getKeys.
+When pickled, a mapping event is converted to a regular Event.
+'''
+class MappingEvent:
+    __slots__ = ()
+
+    @property
+    def event(self):
+        return self
+
+    def getValue(self, key):
+        pass
+
+    def getKeys(self):
+        pass
+
+    def __getitem__(self, key):
+        return self.getValue(key)
+
+    def get(self, key, default = None):
+        return self.getValue(key) if key in self.getKeys() else default
+
+    def __contains__(self, key):
+        return key in self.getKeys()
+
+    def __iter__(self):
+        return iter(self.getKeys())
+
+    def __len__(self):
+        return len(self.getKeys())
+
+    def keys(self):
+        return self.getKeys()
+
+    def items(self):
+        return [(key, self.getValue(key)) for key in self.getKeys()]
+
+    def toDict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.toDict())
+
+    def __reduce__(self):
+        return (Event, (self.toDict(), self.eventType, self.date))
+
+'''
+The structure of schema events: the names of their fields, and the index of every field in their fields tuple.
+'''
+class EventSchema:
+    def __init__(self, fieldNames: List[str]):
+        self.fieldNames = list(fieldNames)
+        self.indexes = {fieldName: i for i, fieldName in enumerate(self.fieldNames)}
+
+    def createEvent(self, values: tuple, eventType, date: datetime):
+        return SchemaEvent(self, values, eventType, dateToTimestamp(date))
+
+'''
+A compact event, whose fields are stored in a tuple according to its schema. Its date is computed from its timestamp.
+'''
+class SchemaEvent(MappingEvent):
+    __slots__ = ("schema", "values", "eventType", "timestamp")
+
+    def __init__(self, schema: EventSchema, values: tuple, eventType, timestamp: int):
+        self.schema = schema
+        self.values = values
+        self.eventType = eventType
+        self.timestamp = timestamp
+
+    @property
+    def date(self):
+        return timestampToDate(self.timestamp)
+
+    def __getitem__(self, key):
+        return self.values[self.schema.indexes[key]]
+
+    def getValue(self, key):
+        return self.values[self.schema.indexes[key]]
+
+    def getKeys(self):
+        return self.schema.indexes.keys()
@@ -0,0 +1,125 @@
+'''
+A columnar representation of a batch of events, as an alternative to an Event object and a dictionary per event.
+The batch keeps a column per attribute, a column of event types and a column of timestamps.
+Numeric columns are stored in typed arrays, and the timestamps are stored as microseconds since the epoch (int64).
+The events of a batch are accessed through lightweight row views (BatchEvent), which can be used wherever an
+Event is used: row.event[key] is the attribute of the row, row.eventType is its type and row.date is its datetime.
+An event batch can be added to a Stream as a single item, and the stream returns its events one by one.
+'''
+
+from __future__ import annotations
+from array import array
+from sys import intern
+from typing import Dict, List
+from Event import Event, MappingEvent, timestampToDate
+
+# Integers up to this value are exactly represented by a float column.
+MAX_EXACT_FLOAT_INTEGER = 2 ** 53
+MAX_INT64 = 2 ** 63 - 1
+
+'''
+Returns a compact column of the given values, and the flags of the integers in it (or None).
+Integers are stored in an int64 array, floats in a float array and a mix of both in a float array, together with
+a byte array which flags the integers, so that the original values are returned. Other values are kept in a list,
+in which equal strings are shared.
+'''
+def createColumn(values: List):
+    types = {type(value) for value in values}
+    if types == {int} and all(-MAX_INT64 <= value <= MAX_INT64 for value in values):
+        return array('q', values), None
+    if types == {float}:
+        return array('d', values), None
+    if types == {int, float} and all(type(value) == float or abs(value) <= MAX_EXACT_FLOAT_INTEGER for value in values):
+        return array('d', values), array('b', (type(value) == int for value in values))
+    return [intern(value) if type(value) == str else value for value in values], None
+
+'''
+A row view of an event in a batch. It is used both as the event and as its attributes mapping.
+Its date is converted from the batch's timestamp on the first access.
+When pickled (e.g. sent to a worker process), a row is converted to a regular Event.
+'''
+class BatchEvent(MappingEvent):
+    __slots__ = ("batch", "index", "cachedDate")
+
+    def __init__(self, batch: EventBatch, index: int):
+        self.batch = batch
+        self.index = index
+        self.cachedDate = None
+
+    @property
+    def eventType(self):
+        return self.batch.eventTypes[self.index]
+
+    @property
+    def date(self):
+        if self.cachedDate is None:
+            self.cachedDate = timestampToDate(self.batch.timestamps[self.index])
+        return self.cachedDate
+
+    @property
+    def timestamp(self):
+        return self.batch.timestamps[self.index]
+
+    def __getitem__(self, key):
+        return self.batch.getValue(key, self.index)
+
+    def getValue(self, key):
+        return self.batch.getValue(key, self.index)
+
+    def getKeys(self):
+        return self.batch.columns.keys()
+
+'''
+A batch of events, stored by columns. The columns are given as lists of values (one list per attribute),
+together with the list of event types and the list of timestamps (microseconds since the epoch).
+'''
+class EventBatch:
+    def __init__(self, columns: Dict[str, List], eventTypes: List, timestamps: List[int]):
+        self.columns = {}
+        self.integerFlags = {}
+        for key, values in columns.items():
+            self.columns[key], self.integerFlags[key] = createColumn(values)
+        self.eventTypes = [intern(eventType) if type(eventType) == str else eventType for eventType in eventTypes]
+        self.timestamps = array('q', timestamps)
+
+    # Creates a batch of the given events. All the events shall have the same attributes.
+    @staticmethod
+    def fromEvents(events: List[Event]):
+        keys = list(events[0].event.keys()) if events else []
+        columns = {key: [event.event[key] for event in events] for key in keys}
+        return EventBatch(columns, [event.eventType for event in events], [event.timestamp for event in events])
+
+    # Creates a batch of columns which are already compact (e.g. views of a mapped file), without copying them.
+    @staticmethod
+    def fromColumns(columns: Dict, eventTypes: List, timestamps):
+        batch = EventBatch.__new__(EventBatch)
+        batch.columns = dict(columns)
+        batch.integerFlags = {key: None for key in columns}
+        batch.eventTypes = eventTypes
+        batch.timestamps = timestamps
+        return batch
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Event batch index out of range")
+        return BatchEvent(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.timestamps)):
+            yield BatchEvent(self, index)
+
+    # Returns the column of the given attribute, for bulk operations. Mixed numeric columns are returned as floats.
+    def getColumn(self, key):
+        return self.columns[key]
+
+    def getValue(self, key, index: int):
+        value = self.columns[key][index]
+        integerFlags = self.integerFlags[key]
+        if integerFlags is not None and integerFlags[index]:
+            return int(value)
+        return value
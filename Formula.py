@@ -1,4 +1,147 @@
 from abc import ABC  # Abstract Base Class
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+'''
+Returns a hashable signature of a function, such that functions with the same code (e.g. two separately
+defined lambda x: x["Peak Price"]) have the same signature. The signature includes the values of the globals which
+the function refers to. Closures, functions with default arguments and functions which refer to unhashable globals
+are compared by the function's identity.
+'''
+def getFunctionSignature(func):
+    code = getattr(func, "__code__", None)
+    if code is None or func.__closure__ or func.__defaults__ or func.__kwdefaults__:
+        return func
+    globalValues = tuple(func.__globals__.get(name) for name in code.co_names)
+    try:
+        hash(globalValues)
+    except TypeError:
+        return func
+    return (func.__module__, code.co_code, code.co_consts, code.co_names, globalValues)
+
+'''
+Compiles formulas and terms into generated Python functions over positional arguments.
+The i-th argument of a compiled function is the event (i.e. the attributes dictionary) bound to the i-th name.
+Every term and formula returns the source of an expression which computes it, and the objects it refers to
+(constants and functions) are stored in the namespace of the generated function.
+Expressions of constants only are folded into a single constant at compile time.
+A vectorized compiler generates a function over lists of events instead, which evaluates every attribute
+into a NumPy column and returns the array of results. Only built-in terms and formulas can be vectorized.
+The parameters of the generated function, and the expressions which the names are bound to, can also be set
+explicitly (setArguments), e.g. in order to bind names to the events of several partial matches.
+'''
+class FormulaCompiler:
+    binaryOperators = {}
+    relationOperators = {}
+
+    def __init__(self, names: list, isVectorized: bool = False):
+        self.parameters = ["e%d" % i for i in range(len(names))]
+        self.arguments = dict(zip(names, self.parameters))
+        self.namespace = {}
+        self.constants = {}
+        self.isVectorized = isVectorized
+        self.statements = []
+        self.columns = {}
+        # Whether the vectorized expression computes arithmetic operations (see createColumn).
+        self.hasArithmetic = False
+
+    # Sets the parameters of the generated function, and the source of the expression bound to every name.
+    def setArguments(self, parameters: list, arguments: dict):
+        self.parameters = parameters
+        self.arguments = arguments
+
+    # Returns the name of a new variable in the generated function's namespace, holding the given object.
+    def addObject(self, obj):
+        variable = "v%d" % len(self.namespace)
+        self.namespace[variable] = obj
+        return variable
+
+    def addConstant(self, value):
+        variable = self.addObject(value)
+        self.constants[variable] = value
+        return variable
+
+    def isConstant(self, expression: str):
+        return expression in self.constants
+
+    def getArgument(self, name: str):
+        if name not in self.arguments:
+            raise NameError("Name %s is not bound to a value" % name)
+        return self.arguments[name]
+
+    # Returns the variable of the column of the given attribute of the events bound to the given name.
+    # Every column is computed once, in the beginning of the generated function.
+    def getColumn(self, name: str, getAttrFunc):
+        signature = (name, getFunctionSignature(getAttrFunc))
+        if signature not in self.columns:
+            column = "c%d" % len(self.columns)
+            self.statements.append("%s = createColumn([%s(e) for e in %s], hasArithmetic)" %
+                                   (column, self.addObject(getAttrFunc), self.getArgument(name)))
+            self.columns[signature] = column
+        return self.columns[signature]
+
+    # Returns the source of a binding dictionary of all the arguments, for terms and formulas which are not compiled.
+    def getBinding(self):
+        if self.isVectorized:
+            raise NotImplementedError()
+        return "{%s}" % ", ".join("%r: %s" % (name, argument) for name, argument in self.arguments.items())
+
+    def createFunction(self, expression: str):
+        body = self.statements + ["return %s" % expression]
+        source = "def compiled(%s):\n    %s\n" % (", ".join(self.parameters), "\n    ".join(body))
+        self.namespace["numpy"] = numpy
+        self.namespace["createColumn"] = createColumn
+        self.namespace["hasArithmetic"] = self.hasArithmetic
+        exec(source, self.namespace)
+        return self.namespace["compiled"]
+
+# Integers up to this value are exactly represented by a float column, and never overflow when they are compared.
+MAX_EXACT_INTEGER = 2 ** 53
+
+'''
+Returns a NumPy column of the given values, which is used by a vectorized function in the same way that the values
+are used by the function which evaluates them one by one, so that both give the same results.
+Numeric columns are only used by comparisons, and only if their values are floats or integers which are exactly
+represented by floats. Otherwise (e.g. the integers of an arithmetic expression, which may overflow, or a division,
+which shall raise on a division by zero), the column holds the values themselves, and its operations are Python's.
+'''
+def createColumn(values: list, hasArithmetic: bool):
+    if not hasArithmetic:
+        types = set(map(type, values))
+        if types == {str}:
+            return numpy.array(values)
+        if types == {float}:
+            return numpy.array(values, dtype = float)
+        if types == {int} and -MAX_EXACT_INTEGER <= min(values) and max(values) <= MAX_EXACT_INTEGER:
+            return numpy.array(values, dtype = numpy.int64)
+        if types == {int, float} and all(abs(value) <= MAX_EXACT_INTEGER for value in values if type(value) == int):
+            return numpy.array(values, dtype = float)
+    column = numpy.empty(len(values), dtype = object)
+    column[:] = values
+    return column
+
+# Compiles the formula into a function which returns whether the events bound to the given names satisfy it.
+def compileFormula(formula, names: list):
+    compiler = FormulaCompiler(names)
+    return compiler.createFunction(formula.getExpression(compiler))
+
+# Compiles the terms into a function which returns the tuple of their values for the events bound to the given names.
+def compileTerms(terms: list, names: list):
+    compiler = FormulaCompiler(names)
+    return compiler.createFunction("(%s,)" % ", ".join(term.getExpression(compiler) for term in terms))
+
+# Compiles the formula into a function over lists of events bound to the given names, which returns
+# a boolean array of whether every element satisfies the formula.
+# Raises NotImplementedError if NumPy is not installed or the formula can not be vectorized.
+def compileVectorizedFormula(formula, names: list):
+    if numpy is None:
+        raise NotImplementedError()
+    compiler = FormulaCompiler(names, True)
+    expression = formula.getExpression(compiler)
+    # a constant result is broadcast to an array.
+    return compiler.createFunction("numpy.broadcast_to(%s, (len(%s),))" % (expression, compiler.getArgument(names[0])))
 
 
 class Term(ABC):
@@ -9,6 +152,19 @@ class Term(ABC):
     def eval(self, binding: dict = {}):
         pass
 
+    '''
+    Returns a hashable signature of the term. Terms with equal signatures evaluate to the same value.
+    By default, a term is only equal to itself.
+    '''
+    def getSignature(self):
+        return self
+
+    '''
+    Returns the source of an expression which evaluates the term in a function generated by the given compiler.
+    '''
+    def getExpression(self, compiler: FormulaCompiler):
+        return "%s.eval(%s)" % (compiler.addObject(self), compiler.getBinding())
+
 
 class AtomicTerm(Term):
     def __init__(self, value):
@@ -16,6 +172,12 @@ class AtomicTerm(Term):
     
     def eval(self, binding: dict = {}):
         return self.value
+
+    def getSignature(self):
+        return (AtomicTerm, self.value)
+
+    def getExpression(self, compiler: FormulaCompiler):
+        return compiler.addConstant(self.value)
     
     def getTermOf(self, names : set):
         return self
@@ -29,6 +191,14 @@ class IdentifierTerm(Term):
         if not type(binding) == dict or not self.name in binding:
             raise NameError("Name %s is not bound to a value" % self.name)
         return self.getAttrFunc(binding[self.name])
+
+    def getSignature(self):
+        return (IdentifierTerm, self.name, getFunctionSignature(self.getAttrFunc))
+
+    def getExpression(self, compiler: FormulaCompiler):
+        if compiler.isVectorized:
+            return compiler.getColumn(self.name, self.getAttrFunc)
+        return "%s(%s)" % (compiler.addObject(self.getAttrFunc), compiler.getArgument(self.name))
     
     def getTermOf(self, names : set):
         if self.name in names:
@@ -44,6 +214,21 @@ class BinaryOperationTerm(Term):
     
     def eval(self, binding: dict = {}):
         return self.binOp(self.lhs.eval(binding), self.rhs.eval(binding))
+
+    def getSignature(self):
+        return (type(self), self.lhs.getSignature(), self.rhs.getSignature(), getFunctionSignature(self.binOp))
+
+    def getExpression(self, compiler: FormulaCompiler):
+        lhs = self.lhs.getExpression(compiler)
+        rhs = self.rhs.getExpression(compiler)
+        if compiler.isConstant(lhs) and compiler.isConstant(rhs):
+            return compiler.addConstant(self.binOp(compiler.constants[lhs], compiler.constants[rhs]))
+        if type(self) in FormulaCompiler.binaryOperators:
+            compiler.hasArithmetic = True
+            return "(%s %s %s)" % (lhs, FormulaCompiler.binaryOperators[type(self)], rhs)
+        if compiler.isVectorized:
+            raise NotImplementedError()
+        return "%s(%s, %s)" % (compiler.addObject(self.binOp), lhs, rhs)
         
 class PlusTerm(BinaryOperationTerm):
     def __init__(self, lhs, rhs):
@@ -104,6 +289,25 @@ class Formula(ABC):
     def getFormulaOf(self, names : set):
         pass
 
+    '''
+    Returns a hashable signature of the formula. Formulas with equal signatures are equivalent.
+    By default, a formula is only equivalent to itself.
+    '''
+    def getSignature(self):
+        return self
+
+    '''
+    Returns the source of an expression which evaluates the formula in a function generated by the given compiler.
+    '''
+    def getExpression(self, compiler: FormulaCompiler):
+        return "%s.eval(%s)" % (compiler.addObject(self), compiler.getBinding())
+
+    '''
+    Returns the list of formulas whose conjunction is this formula.
+    '''
+    def getConjuncts(self):
+        return [self]
+
 class AtomicFormula(Formula):
     def __init__(self, leftTerm, rightTerm, relBinOp):
         self.leftTerm = leftTerm
@@ -112,6 +316,20 @@ class AtomicFormula(Formula):
     
     def eval(self, binding: dict = {}):
         return self.relBinOp(self.leftTerm.eval(binding), self.rightTerm.eval(binding))
+
+    def getSignature(self):
+        return (type(self), self.leftTerm.getSignature(), self.rightTerm.getSignature(), getFunctionSignature(self.relBinOp))
+
+    def getExpression(self, compiler: FormulaCompiler):
+        leftTerm = self.leftTerm.getExpression(compiler)
+        rightTerm = self.rightTerm.getExpression(compiler)
+        if compiler.isConstant(leftTerm) and compiler.isConstant(rightTerm):
+            return compiler.addConstant(self.relBinOp(compiler.constants[leftTerm], compiler.constants[rightTerm]))
+        if type(self) in FormulaCompiler.relationOperators:
+            return "(%s %s %s)" % (leftTerm, FormulaCompiler.relationOperators[type(self)], rightTerm)
+        if compiler.isVectorized:
+            raise NotImplementedError()
+        return "%s(%s, %s)" % (compiler.addObject(self.relBinOp), leftTerm, rightTerm)
         
 class EqFormula(AtomicFormula):
     def __init__(self, leftTerm, rightTerm):
@@ -195,6 +413,18 @@ class BinaryLogicOpFormula(Formula):
     def eval(self, binding: dict = {}):
         return self.binaryLogicOp(self.leftFormula.eval(binding), self.rightFormula.eval(binding))
 
+    def getSignature(self):
+        return (type(self), self.leftFormula.getSignature(), self.rightFormula.getSignature(), getFunctionSignature(self.binaryLogicOp))
+
+    def getExpression(self, compiler: FormulaCompiler):
+        leftFormula = self.leftFormula.getExpression(compiler)
+        rightFormula = self.rightFormula.getExpression(compiler)
+        if compiler.isConstant(leftFormula) and compiler.isConstant(rightFormula):
+            return compiler.addConstant(self.binaryLogicOp(compiler.constants[leftFormula], compiler.constants[rightFormula]))
+        if compiler.isVectorized:
+            raise NotImplementedError()
+        return "%s(%s, %s)" % (compiler.addObject(self.binaryLogicOp), leftFormula, rightFormula)
+
 class AndFormula(BinaryLogicOpFormula):
     def __init__(self, leftFormula, rightFormula):
         super().__init__(leftFormula, rightFormula, lambda x, y: x and y)
@@ -211,9 +441,46 @@ class AndFormula(BinaryLogicOpFormula):
         else:
             return None
 
+    def getConjuncts(self):
+        return self.leftFormula.getConjuncts() + self.rightFormula.getConjuncts()
+
+    # A short-circuit "and". A constant operand decides the result or is dropped.
+    def getExpression(self, compiler: FormulaCompiler):
+        leftFormula = self.leftFormula.getExpression(compiler)
+        if compiler.isConstant(leftFormula) and not compiler.constants[leftFormula]:
+            return leftFormula
+        rightFormula = self.rightFormula.getExpression(compiler)
+        if compiler.isConstant(leftFormula):
+            return rightFormula
+        if compiler.isConstant(rightFormula) and compiler.constants[rightFormula]:
+            return leftFormula
+        if compiler.isVectorized:
+            return "(%s & %s)" % (leftFormula, rightFormula)
+        return "(%s and %s)" % (leftFormula, rightFormula)
+
 class TrueFormula(Formula):
     def __init__(self):
         pass
 
     def eval(self, binding: dict = {}):
         return True
+
+    def getSignature(self):
+        return (TrueFormula,)
+
+    def getExpression(self, compiler: FormulaCompiler):
+        return compiler.addConstant(True)
+
+    def getConjuncts(self):
+        return []
+
+
+FormulaCompiler.binaryOperators = {PlusTerm: "+", MinusTerm: "-", MulTerm: "*", DivTerm: "/"}
+FormulaCompiler.relationOperators = {
+    EqFormula: "==",
+    NotEqFormula: "!=",
+    GreaterThanFormula: ">",
+    SmallerThanFormula: "<",
+    GreaterThanEqFormula: ">=",
+    SmallerThanEqFormula: "<="
+}
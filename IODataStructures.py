@@ -1,6 +1,10 @@
 
 from abc import ABC
-from queue import Queue
+from itertools import islice, chain
+from typing import List
+from weakref import WeakSet
+import threading
+from EventBatch import EventBatch
 
 '''
 Represents a container of objects. Dedicated to matches, but can be implemented by a stream.
@@ -19,45 +23,259 @@ class Container(ABC):
     def close(self):
         pass
 
+    # Notes that another producer (e.g. the evaluation of a pattern) adds items to the container, and closes it once
+    # when it is done. Called by the CEP engine before the producer starts.
+    def addProducer(self):
+        pass
+
+    # Notes that the producer of the items failed with the given error, which is passed on to the consumer.
+    def setError(self, error: Exception):
+        pass
+
+'''
+The shared, append-only log of a stream and of its duplicates.
+The items are stored in segments of segmentSize items, and a closed stream ends with None. Every stream which reads the log has a cursor (the index
+of its next item), and a segment is reclaimed once the cursors of all the streams have passed it.
+If the log is bounded by maxSize items, adding an item blocks while the slowest stream is maxSize items behind.
+'''
+class StreamLog:
+    segmentSize = 1024
+
+    def __init__(self, maxSize: int = 0):
+        self.maxSize = maxSize
+        self.segments = []
+        # The index of the first item in the first segment, and the number of items ever added.
+        self.firstIndex = 0
+        self.length = 0
+        self.streams = WeakSet()
+        self.condition = threading.Condition()
+        # The error of the producer, which is raised by the streams which reach the end of the log.
+        self.error = None
+
+    # Returns the index of the next item of the slowest stream. Shall be called while holding the condition.
+    def getMinPosition(self):
+        return min((stream.position for stream in self.streams), default = self.length)
+
+    # Adds the given items, waiting for room for them in a bounded log.
+    def addItems(self, items: List):
+        with self.condition:
+            while items:
+                if self.maxSize > 0:
+                    while self.length - self.getMinPosition() >= self.maxSize:
+                        self.condition.wait()
+                    roomSize = self.maxSize - (self.length - self.getMinPosition())
+                else:
+                    roomSize = len(items)
+                added, items = items[:roomSize], items[roomSize:]
+                while added:
+                    if not self.segments or len(self.segments[-1]) == StreamLog.segmentSize:
+                        self.segments.append([])
+                    segment = self.segments[-1]
+                    segmentAdded = added[:StreamLog.segmentSize - len(segment)]
+                    segment.extend(segmentAdded)
+                    self.length += len(segmentAdded)
+                    added = added[len(segmentAdded):]
+                self.condition.notify_all()
+
+    # Returns the items from start to stop. Shall be called while holding the condition.
+    def getItems(self, start: int, stop: int):
+        items = []
+        while start < stop:
+            segmentIndex, offset = divmod(start - self.firstIndex, StreamLog.segmentSize)
+            segmentItems = self.segments[segmentIndex][offset:offset + stop - start]
+            items.extend(segmentItems)
+            start += len(segmentItems)
+        return items
+
+    # Reclaims the segments which all the streams have passed. Shall be called while holding the condition.
+    def reclaim(self):
+        minPosition = self.getMinPosition()
+        while self.segments and self.firstIndex + StreamLog.segmentSize <= minPosition:
+            del self.segments[0]
+            self.firstIndex += StreamLog.segmentSize
+        if self.maxSize > 0:
+            self.condition.notify_all()
+
 '''
 An implementation of the container.
 It is also used for the input streams to the CEP engine.
+An input stream may also carry batches of events (EventBatch), which are returned event by event.
+A stream is a cursor over a log of items (see StreamLog). A duplicate of a stream shares its log and has its own
+cursor, so it is created without copying the items, and the items added to either of them are read by both.
+A stream may be bounded by maxSize items, in which case adding an item blocks until the slowest stream of its log
+is less than maxSize items behind (a batch of events counts as a single item). The duplicate of a bounded stream
+takes over its cursor, so that a stream which is no longer read does not hold back the producer.
+Items may also be moved in bulk (addItems and getItems), under a single acquisition of the log's lock.
+A live stream is still being filled by a producer (e.g. a file reader thread) while it is consumed.
+If the producer fails, it sets its error (setError) and closes the stream, and the error is raised by the readers
+of the stream once they have read all its items, instead of the end of the stream.
 '''
 class Stream(Container):
-    def __init__(self):
-        self.stream = Queue()
+    def __init__(self, maxSize: int = 0, isLive: bool = False):
+        self.log = StreamLog(maxSize)
+        self.isLive = isLive
+        # The index of the next item in the log.
+        self.position = 0
+        # The batch whose events are currently returned, and the index of the next event in it.
+        self.currentBatch = None
+        self.currentIndex = 0
+        # Whether the cursor of this stream was handed over to a duplicate (see duplicate).
+        self.isHandedOver = False
+        self.log.streams.add(self)
+
+    @property
+    def maxSize(self):
+        return self.log.maxSize
 
     def __next__(self):
-        nextItem = self.stream.get(block=True)  # Blocking get 
-        if nextItem == None:
+        if self.currentBatch is not None:
+            if self.currentIndex < len(self.currentBatch):
+                self.currentIndex += 1
+                return self.currentBatch[self.currentIndex - 1]
+            self.currentBatch = None
+        self.checkCursor()
+        log = self.log
+        with log.condition:
+            while self.position == log.length:
+                log.condition.wait()
+            nextItem = log.getItems(self.position, self.position + 1)[0]
+            self.advance(1)
+        if nextItem is None:
+            self.raiseError()
             raise StopIteration()
+        if type(nextItem) == EventBatch:
+            self.currentBatch = nextItem
+            self.currentIndex = 0
+            return self.__next__()
         return nextItem
-    
+
     def __iter__(self):
         return self
 
+    # Moves the cursor by the given number of items. Shall be called while holding the log's condition.
+    def advance(self, itemsNum: int):
+        previousSegment = self.position // StreamLog.segmentSize
+        self.position += itemsNum
+        if self.position // StreamLog.segmentSize != previousSegment or self.log.maxSize > 0:
+            self.log.reclaim()
+
     def addItem(self, item):
-        self.stream.put(item)
-    
+        self.log.addItems([item])
+
+    # Adds the given items. In a bounded stream, blocks until there is room for them, adding as many as possible at once.
+    def addItems(self, items):
+        self.log.addItems(list(items))
+
+    # Returns at most maxCount events, blocking until there is at least one (batches are returned event by event).
+    # An empty list is returned when the stream is closed and all its events have been returned. As in iteration,
+    # the closing None is consumed then, so a stream which is closed several times (e.g. an output stream with
+    # several producers) returns an empty list once per close, and can be read by getItems and iteration alike.
+    def getItems(self, maxCount: int):
+        self.checkCursor()
+        items = []
+        if self.currentBatch is not None:
+            endIndex = min(self.currentIndex + maxCount, len(self.currentBatch))
+            items = [self.currentBatch[index] for index in range(self.currentIndex, endIndex)]
+            self.currentIndex += len(items)
+            if self.currentIndex >= len(self.currentBatch):
+                self.currentBatch = None
+        log = self.log
+        with log.condition:
+            if not items:
+                while self.position == log.length:
+                    log.condition.wait()
+            newItems = log.getItems(self.position, min(log.length, self.position + maxCount - len(items)))
+            takenCount = 0
+            for item in newItems:
+                if item is None:
+                    if not items:
+                        takenCount += 1
+                    break
+                if len(items) == maxCount:
+                    break
+                takenCount += 1
+                if type(item) == EventBatch:
+                    batchCount = min(len(item), maxCount - len(items))
+                    items.extend(item[index] for index in range(batchCount))
+                    if batchCount < len(item):
+                        self.currentBatch = item
+                        self.currentIndex = batchCount
+                else:
+                    items.append(item)
+            if takenCount:
+                self.advance(takenCount)
+        if not items:
+            self.raiseError()
+        return items
+
     def close(self):
-        self.stream.put(None)
-    
-    def duplicate(self):
-        ret = Stream()
-        ret.stream.queue = self.stream.queue.copy()
+        self.log.addItems([None])
+
+    def setError(self, error: Exception):
+        self.log.error = error
+
+    # Raises the error of the producer, if it failed. Called when the end of the stream is reached.
+    def raiseError(self):
+        if self.log.error is not None:
+            raise self.log.error
+
+    # Returns a stream of the items which were not read yet from this stream, without copying them.
+    # The duplicate shares the log of this stream (and its bound), so maxSize is ignored.
+    # In a bounded log, the producer waits for every stream to read the items, so a stream which is no longer read
+    # would block it forever. Therefore, the duplicate of a bounded stream takes over its cursor instead of adding
+    # a cursor, and this stream can no longer be read.
+    def duplicate(self, maxSize: int = 0):
+        self.checkCursor()
+        ret = Stream.__new__(Stream)
+        ret.log = self.log
+        ret.isLive = self.isLive
+        ret.isHandedOver = False
+        ret.currentBatch = self.currentBatch
+        ret.currentIndex = self.currentIndex
+        with self.log.condition:
+            ret.position = self.position
+            self.log.streams.add(ret)
+            if self.log.maxSize > 0:
+                self.log.streams.discard(self)
+                self.isHandedOver = True
+                self.currentBatch = None
         return ret
-    
+
+    # Raises if the cursor of this stream was handed over to a duplicate, so its items can not be read.
+    def checkCursor(self):
+        if self.isHandedOver:
+            raise ValueError("The items of a duplicated bounded stream can only be read from its duplicate")
+
     def getItem(self):
         return self.__next__()
-    
+
+    # Returns the first count items in the stream without consuming them. Batches are returned event by event.
+    def peekItems(self, count):
+        self.checkCursor()
+        pending = [] if self.currentBatch is None else \
+            [self.currentBatch[index] for index in range(self.currentIndex, len(self.currentBatch))]
+        with self.log.condition:
+            logItems = self.log.getItems(self.position, min(self.log.length, self.position + count))
+        items = chain(pending, chain.from_iterable(item if type(item) == EventBatch else [item] for item in logItems))
+        return list(islice(items, count))
+
+    # Returns the number of items in the stream. A batch is counted as a single item.
     def count(self):
-        return self.stream.qsize()
-    
+        self.checkCursor()
+        pending = 0 if self.currentBatch is None else len(self.currentBatch) - self.currentIndex
+        return self.log.length - self.position + pending
+
     def first(self):
-        return self.stream.queue[0]
-    
+        self.checkCursor()
+        if self.currentBatch is not None and self.currentIndex < len(self.currentBatch):
+            return self.currentBatch[self.currentIndex]
+        with self.log.condition:
+            x = self.log.getItems(self.position, self.position + 1)[0]
+        return x[0] if type(x) == EventBatch else x
+
     def last(self):
-        x = self.stream.queue[-1]  
-        if not x: # if stream is closed last is None. We need the one before None.
-            x = self.stream.queue[-2]
-        return x
\ No newline at end of file
+        with self.log.condition:
+            x = self.log.getItems(self.log.length - 1, self.log.length)[0]
+            if not x: # if stream is closed last is None. We need the one before None.
+                x = self.log.getItems(self.log.length - 2, self.log.length - 1)[0]
+        return x[-1] if type(x) == EventBatch else x
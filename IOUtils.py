@@ -1,9 +1,18 @@
 from __future__ import annotations
 from typing import List
-from Event import Event
+from Event import Event, EventSchema, SchemaEvent, dateToTimestamp
 from IODataStructures import Stream, Container
+from PatternMatch import PatternMatch
 from Utils import stringToNumber
-from datetime import datetime
+from datetime import datetime, timedelta
+from EventBatch import EventBatch
+from BinaryEventFile import BinaryEventFile, BinaryEventFileWriter
+from itertools import islice
+import csv
+import threading
+
+# The number of events which are parsed and added to a stream at once.
+READ_CHUNK_SIZE = 1000
 
 '''
 Receives a file and returns a stream of events.
@@ -12,31 +21,266 @@ The file will be parsed as so:
 * Each line will be a different event
 * Each line will be split on "," and the resulting array will be stored in an "Event",
   and the keys are determined from the given list "KeyMap".
+If batchSize is given, the events are stored by columns in batches of batchSize events (see EventBatch),
+instead of an Event object and a dictionary per event.
+If compact is set, the events are schema events (see EventSchema), whose fields are stored in tuples.
+If maxSize is given, the file is read incrementally by a background thread into a live stream of at most
+maxSize items, so the events can be consumed while the file is read, and the memory does not depend on its size.
+If the file can not be read or parsed, the error is raised by the readers of the live stream once they have read
+all the events before it.
+Otherwise, the whole file is read into a closed stream.
+If columnTypes is given (the type of every column in keyMap, see EventFileSchema), the lines are parsed according
+to it by the csv module, instead of guessing the type of every field. timeFormat is the format of the time column.
+'''
+def fileInput(filePath: str, keyMap: List, eventTypeKey: str, eventTimeKey: str, batchSize: int = None,
+              compact: bool = False, maxSize: int = None, columnTypes: List = None,
+              timeFormat: str = None) -> Stream:
+    fileSchema = EventFileSchema(keyMap, columnTypes, eventTypeKey, eventTimeKey, timeFormat) if columnTypes else None
+    if maxSize:
+        events = Stream(maxSize, isLive = True)
+        threading.Thread(target = readEvents, args = (filePath, keyMap, eventTypeKey, eventTimeKey, batchSize, compact,
+                                                      events, fileSchema),
+                         daemon = True).start()
+        return events
+    events = Stream()
+    readEvents(filePath, keyMap, eventTypeKey, eventTimeKey, batchSize, compact, events, fileSchema)
+    return events
+
+# Reads the events of the file line by line into the given stream, and closes it.
+# If the file can not be read, the stream is closed with the error as well, so its readers do not wait for it.
+def readEvents(filePath: str, keyMap: List, eventTypeKey: str, eventTimeKey: str, batchSize: int, compact: bool,
+               events: Stream, fileSchema: EventFileSchema = None):
+    try:
+        with open(filePath, "r", newline = "" if fileSchema else None) as f:
+            if fileSchema:
+                fileSchema.readEvents(f, batchSize, compact, events)
+            elif batchSize:
+                lines = list(islice(f, batchSize))
+                while lines:
+                    events.addItem(parseEventBatch(lines, keyMap, eventTypeKey, eventTimeKey))
+                    lines = list(islice(f, batchSize))
+            else:
+                schema = EventSchema(keyMap) if compact else None
+                lines = list(islice(f, READ_CHUNK_SIZE))
+                while lines:
+                    events.addItems([parseEvent(line, keyMap, eventTypeKey, eventTimeKey, schema) for line in lines])
+                    lines = list(islice(f, READ_CHUNK_SIZE))
+    except Exception as error:
+        events.setError(error)
+        raise
+    finally:
+        events.close()
+
+'''
+A typed schema of an event file, which is compiled into a converter of the fields of a line (a list of strings)
+into the values of an event. The type of a column is a function from the field to its value, usually int, float
+or str (str columns are not converted at all).
+The time of an event is parsed from the time field according to timeFormat (a strptime format). The default format
+(YYYYMMDDhhmm) is parsed by slicing, and since consecutive events usually have the same time, the date of the
+previous line is reused when its time field is the same.
+'''
+class EventFileSchema:
+    defaultTimeFormat = "%Y%m%d%H%M"
+
+    def __init__(self, keyMap: List, columnTypes: List, eventTypeKey: str, eventTimeKey: str, timeFormat: str = None):
+        if len(columnTypes) != len(keyMap):
+            raise ValueError("Expected a column type for each of the %d keys" % len(keyMap))
+        self.keyMap = list(keyMap)
+        self.typeIndex = self.keyMap.index(eventTypeKey)
+        self.timeIndex = self.keyMap.index(eventTimeKey)
+        self.timeFormat = timeFormat if timeFormat else EventFileSchema.defaultTimeFormat
+        self.convertFields = EventFileSchema.compileConverter(columnTypes)
+        self.eventSchema = EventSchema(keyMap)
+        self.days = {}
+        self.lastTime = None
+        self.lastDate = None
+        self.lastTimestamp = None
+
+    # Generates a function which converts the fields of a line into a list of values, a column at a time.
+    @staticmethod
+    def compileConverter(columnTypes: List):
+        namespace = {}
+        values = []
+        for i, columnType in enumerate(columnTypes):
+            if columnType is str:
+                values.append("fields[%d]" % i)
+            else:
+                namespace["convert%d" % i] = columnType
+                values.append("convert%d(fields[%d])" % (i, i))
+        exec("def convertFields(fields):\n    return [%s]\n" % ", ".join(values), namespace)
+        return namespace["convertFields"]
+
+    # Returns the date and the timestamp of the given time field.
+    def parseTime(self, time: str):
+        if time != self.lastTime:
+            if self.timeFormat == EventFileSchema.defaultTimeFormat:
+                day = self.days.get(time[:8])
+                if day is None:
+                    day = self.days[time[:8]] = datetime(int(time[0:4]), int(time[4:6]), int(time[6:8]))
+                date = day + timedelta(hours=int(time[8:10]), minutes=int(time[10:12]))
+            else:
+                date = datetime.strptime(time, self.timeFormat)
+            self.lastTime, self.lastDate, self.lastTimestamp = time, date, dateToTimestamp(date)
+        return self.lastDate, self.lastTimestamp
+
+    def createEvent(self, fields: List[str], compact: bool = False):
+        values = self.convertFields(fields)
+        date, timestamp = self.parseTime(fields[self.timeIndex])
+        if compact:
+            return SchemaEvent(self.eventSchema, tuple(values), values[self.typeIndex], timestamp)
+        return Event(dict(zip(self.keyMap, values)), values[self.typeIndex], date, timestamp)
+
+    def createEventBatch(self, rows: List[List[str]]):
+        convertFields = self.convertFields
+        columns = list(zip(*[convertFields(fields) for fields in rows]))
+        timestamps = [self.parseTime(fields[self.timeIndex])[1] for fields in rows]
+        return EventBatch(dict(zip(self.keyMap, columns)), columns[self.typeIndex], timestamps)
+
+    # Reads the lines of the given file into the given stream.
+    def readEvents(self, f, batchSize: int, compact: bool, events: Stream):
+        rows = csv.reader(f)
+        if batchSize:
+            batch = list(islice(rows, batchSize))
+            while batch:
+                events.addItem(self.createEventBatch(batch))
+                batch = list(islice(rows, batchSize))
+        else:
+            batch = list(islice(rows, READ_CHUNK_SIZE))
+            while batch:
+                events.addItems([self.createEvent(fields, compact) for fields in batch])
+                batch = list(islice(rows, READ_CHUNK_SIZE))
+
 '''
-def fileInput(filePath: str, keyMap: List, eventTypeKey: str, eventTimeKey: str) -> Stream:
-    with open(filePath, "r") as f:
-        content = f.readlines()
+Converts an event file to a binary event file (see BinaryEventFile), which is read by binaryFileInput
+without parsing. The parameters are the same as in fileInput, and the type of every column is int, float or str.
+'''
+def convertToBinaryFile(filePath: str, binaryFilePath: str, keyMap: List, eventTypeKey: str, eventTimeKey: str,
+                        columnTypes: List, timeFormat: str = None):
+    fileSchema = EventFileSchema(keyMap, columnTypes, eventTypeKey, eventTimeKey, timeFormat)
+    writer = BinaryEventFileWriter(binaryFilePath, keyMap, columnTypes, eventTypeKey)
+    with open(filePath, "r", newline = "") as f:
+        for fields in csv.reader(f):
+            writer.write(fileSchema.convertFields(fields), fileSchema.parseTime(fields[fileSchema.timeIndex])[1])
+    writer.close()
+
+'''
+Receives a binary event file (see convertToBinaryFile) and returns a stream of its events.
+The file is mapped to memory, and batchSize, compact and maxSize are the same as in fileInput.
+The numeric columns of the batches are views of the mapped file rather than copies.
+'''
+def binaryFileInput(filePath: str, batchSize: int = None, compact: bool = False, maxSize: int = None) -> Stream:
+    binaryFile = BinaryEventFile(filePath)
+    if maxSize:
+        events = Stream(maxSize, isLive = True)
+        threading.Thread(target = binaryFile.readEvents, args = (batchSize, compact, events), daemon = True).start()
+        return events
     events = Stream()
-    for i in range(len(content)):
-        eventLine = content[i].replace("\n", "").split(",")
-        for j in range(len(eventLine)):
-            eventLine[j] = stringToNumber(eventLine[j])
-        # Create the fields of an event object.
-        event = dict(zip(keyMap, eventLine))
-        eventType = event[eventTypeKey]
-        eventTime = datetime(year=int(str(event[eventTimeKey])[0:4]), month=int(str(event[eventTimeKey])[4:6]), day=int(str(event[eventTimeKey])[6:8]), hour=int(str(event[eventTimeKey])[8:10]), minute=int(str(event[eventTimeKey])[10:12]))
-        # Add the event to the stream according to created field.
-        events.addItem(Event(event, eventType, eventTime))
-    events.close()
+    binaryFile.readEvents(batchSize, compact, events)
     return events
 
+def parseEventTime(eventTime):
+    eventTime = str(eventTime)
+    return datetime(year=int(eventTime[0:4]), month=int(eventTime[4:6]), day=int(eventTime[6:8]), hour=int(eventTime[8:10]), minute=int(eventTime[10:12]))
+
+def parseEvent(line: str, keyMap: List, eventTypeKey: str, eventTimeKey: str, schema: EventSchema = None):
+    eventLine = line.replace("\n", "").split(",")
+    for j in range(len(eventLine)):
+        eventLine[j] = stringToNumber(eventLine[j])
+    # Create the fields of an event object.
+    event = dict(zip(keyMap, eventLine))
+    eventType = event[eventTypeKey]
+    eventTime = parseEventTime(event[eventTimeKey])
+    if schema:
+        return schema.createEvent(tuple(eventLine), eventType, eventTime)
+    return Event(event, eventType, eventTime)
+
+def parseEventBatch(lines: List[str], keyMap: List, eventTypeKey: str, eventTimeKey: str):
+    columns = {key: [] for key in keyMap}
+    timestamps = []
+    for line in lines:
+        eventLine = line.replace("\n", "").split(",")
+        for key, value in zip(keyMap, eventLine):
+            columns[key].append(stringToNumber(value))
+        timestamps.append(dateToTimestamp(parseEventTime(columns[eventTimeKey][-1])))
+    return EventBatch(columns, columns[eventTypeKey], timestamps)
+
 '''
 Writes output matches to a file in the subfolder "Matches".
 It supports any iterable as output matches.
 '''
 def fileOutput(matches, fileOutputName: str = 'matches.txt'):
-    with open("Matches/" + fileOutputName, 'w') as f:
-        for match in matches:
-            for event in match.events:
-                f.write("%s\n" % event.event)
-            f.write("\n")
\ No newline at end of file
+    writer = MatchFileWriter("Matches/" + fileOutputName)
+    for match in matches:
+        writer.addItem(match)
+    writer.close()
+
+'''
+An output container which writes the matches to a file while they are produced, instead of keeping them in memory.
+The matches are buffered and formatted bufferSize matches at a time, and are written in large chunks.
+By default, every event of a match is written in a separate line, followed by an empty line (as in fileOutput).
+In the compact format, an event is written once, the first time it appears in a match, as "e <id> <event>",
+and a match is written as "m" followed by the ids of its events. The ids of the last eventsNum written events
+are remembered; an event which appears again after it was forgotten is written again with a new id.
+A container which is shared by several evaluations (e.g. a container of several patterns, each closing it
+when its evaluation ends) is closed by the last of them. The CEP engine registers every evaluation (addProducer),
+and a container without registered producers is closed by its first close. Adding a match to a closed container
+raises a ValueError.
+'''
+class MatchFileWriter(Container):
+    def __init__(self, filePath: str, compact: bool = False, bufferSize: int = 1000, eventsNum: int = 100000):
+        self.file = open(filePath, "w", buffering = 1 << 20)
+        self.compact = compact
+        self.bufferSize = bufferSize
+        self.eventsNum = eventsNum
+        self.producersNum = 0
+        self.closesNum = 0
+        self.buffer = []
+        # The ids of the recently written events, by the ids of their objects, and the events themselves.
+        self.eventIds = {}
+        self.nextEventId = 0
+        self.lock = threading.Lock()
+
+    def addProducer(self):
+        with self.lock:
+            if self.file.closed:
+                raise ValueError("A producer can not be added to a closed match file")
+            self.producersNum += 1
+
+    def addItem(self, item: PatternMatch):
+        with self.lock:
+            if self.file.closed:
+                raise ValueError("A match can not be added to a closed match file")
+            self.buffer.append(item)
+            if len(self.buffer) >= self.bufferSize:
+                self.flush()
+
+    def close(self):
+        with self.lock:
+            self.closesNum += 1
+            if self.closesNum == max(self.producersNum, 1):
+                self.flush()
+                self.file.close()
+
+    # Formats the buffered matches and writes them at once.
+    def flush(self):
+        if self.compact:
+            text = "".join([self.formatCompactMatch(match) for match in self.buffer])
+        else:
+            text = "".join(["".join(["%s\n" % event.event for event in match.events]) + "\n" for match in self.buffer])
+        self.file.write(text)
+        self.buffer = []
+
+    def formatCompactMatch(self, match: PatternMatch):
+        lines = []
+        ids = []
+        for event in match.events:
+            entry = self.eventIds.get(id(event))
+            if entry is None:
+                entry = self.eventIds[id(event)] = (self.nextEventId, event)
+                self.nextEventId += 1
+                lines.append("e %d %s\n" % (entry[0], event.event))
+                if len(self.eventIds) > self.eventsNum:
+                    del self.eventIds[next(iter(self.eventIds))]
+            ids.append(str(entry[0]))
+        lines.append("m %s\n" % " ".join(ids))
+        return "".join(lines)